@@ -0,0 +1,4 @@
+from .run import parse_arguments
+
+if __name__ == "__main__":
+    parse_arguments()
@@ -1,9 +1,12 @@
 import enum
+import functools
 import itertools
 import logging
-from typing import List
+import re
+import sys
+from typing import Iterable, List
 
-import tqdm
+_ANSI_ESCAPE_RE = re.compile(r'\x1b\[[0-9;]*m')
 
 
 class SpecialCharOperation(enum.Enum):
@@ -11,11 +14,55 @@ class SpecialCharOperation(enum.Enum):
     REPLACE = 2
 
 
+class NoProgressBar():
+    """Stand-in for a tqdm progress bar, used when progress bars are not shown"""
+    def __init__(self, iterable: Iterable = None, **kwargs):
+        self.iterable = iterable
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def update(self, n: int = 1) -> None:
+        pass
+
+    def set_description(self, desc: str = None) -> None:
+        pass
+
+
+@functools.lru_cache(maxsize=None)
+def load_tqdm():
+    """Returns the tqdm module if progress bars should be shown (tqdm is installed and stderr is a terminal), None if not"""
+    if not sys.stderr.isatty():
+        return None
+    try:
+        import tqdm
+        return tqdm
+    except ImportError:
+        return None
+
+
+def get_progress_bar(iterable: Iterable = None, **kwargs):
+    """Returns a tqdm progress bar with the given arguments if progress bars are shown, a NoProgressBar if not"""
+    tqdm = load_tqdm()
+    return tqdm.tqdm(iterable, **kwargs) if tqdm else NoProgressBar(iterable, **kwargs)
+
+
 class TqdmHandler(logging.Handler):
     def emit(self, record: logging.LogRecord):
         try:
             msg = self.format(record)
-            tqdm.tqdm.write(msg)
+            # Print around any progress bars, if shown
+            tqdm = load_tqdm()
+            if tqdm:
+                tqdm.tqdm.write(msg)
+            else:
+                print(msg)
             self.flush()
         except (KeyboardInterrupt, SystemExit):
             raise
@@ -31,3 +78,12 @@ def ranges(i: List[int]) -> str:
         result.append((b[0][1], b[-1][1]))
 
     return ' '.join(['0x{:0>4X}..0x{:0>4X}'.format(x, y) for x, y in result])
+
+
+def ascii_table(rows: List[List[str]]) -> str:
+    """Turns a list of rows, the first being the heading, into a bordered ASCII table (ignoring colour codes for alignment)"""
+    widths = [max(len(_ANSI_ESCAPE_RE.sub('', cell)) for cell in column) for column in zip(*rows)]
+    border = '+' + '+'.join('-' * (width + 2) for width in widths) + '+'
+    lines = ['| ' + ' | '.join(cell + ' ' * (width - len(_ANSI_ESCAPE_RE.sub('', cell))) for cell, width in zip(row, widths)) + ' |' for row in rows]
+
+    return '\n'.join([border, lines[0], border] + lines[1:] + ([border] if len(lines) > 1 else []))
@@ -1,23 +1,43 @@
 import argparse
+import asyncio
+import concurrent.futures
 import json
 import logging
 import os
 import re
 import shlex
 from argparse import Namespace
-from typing import List, Tuple
+from typing import Dict, List, Set, Tuple, Union
 
-import tqdm
-
-from .helpers import SpecialCharOperation, TqdmHandler
+from .helpers import SpecialCharOperation, TqdmHandler, get_progress_bar
 from .output_results import print_results, write_report
 from .test_process_obfuscation import TestCase, TestProcessObfuscation
 
+_ALNUM_RE = re.compile(r'[a-zA-Z0-9]')
+# Lone surrogates can't be passed on a command line (or written to a report), so spawning them is pointless
+_UNSCANNABLE = frozenset(range(0xD800, 0xE000))
+
+
+async def run_checks(test: TestProcessObfuscation, test_case: TestCase) -> Dict[str, Union[Set[Tuple[int, str]], str, None]]:
+    """ Runs all individual tests of a test case concurrently, sharing the test's process limit """
+    test_names = ['option_char', 'char_insert', 'char_substitution', 'quotes', 'shorthand_command']
+    # On Windows, each child process is run (and waited for) from a worker thread; the default executor is capped
+    #  at a few workers regardless of --threads, so provide one sized to the test's process limit
+    with concurrent.futures.ThreadPoolExecutor(max_workers=test.threads) as executor:
+        asyncio.get_running_loop().set_default_executor(executor)
+        test_outcomes = await asyncio.gather(test.check_option_char(test_case.arg_index),
+                                             test.check_special_chars(test_case.char_offset, SpecialCharOperation.INSERT),
+                                             test.check_special_chars(test_case.char_offset, SpecialCharOperation.REPLACE),
+                                             test.check_quote_injection(test_case.arg_index),
+                                             test.check_shortened_option(test_case.arg_index))
+        await test.wait_post_commands()
+    return dict(zip(test_names, test_outcomes))
+
 
-def run_tests(test_cases: List[TestCase], threads: int, report_dir: str, log: logging.Logger) -> None:
+def run_tests(test_cases: List[TestCase], threads: int, report_dir: str, encoding: str, log: logging.Logger) -> None:
     """ For a list of commands: run tests, create reports, write summary to stdout """
     result = {}
-    with tqdm.tqdm(test_cases, position=0, disable=len(test_cases) <= 1) as pbar:
+    with get_progress_bar(test_cases, position=0, disable=len(test_cases) <= 1) as pbar:
         for test_case in pbar:
             # Extract display name
             _, display_name = os.path.split(test_case.command[0].strip('"'))
@@ -28,18 +48,13 @@ def run_tests(test_cases: List[TestCase], threads: int, report_dir: str, log: lo
                 test = TestProcessObfuscation(test_case, threads, log)
 
                 # Run individual tests
-                test_outcomes = {'option_char': test.check_option_char(test_case.arg_index),
-                                 'char_insert': test.check_special_chars(test_case.char_offset, SpecialCharOperation.INSERT),
-                                 'char_substitution': test.check_special_chars(test_case.char_offset, SpecialCharOperation.REPLACE),
-                                 'quotes': test.check_quote_injection(test_case.arg_index),
-                                 'shorthand_command': test.check_shortened_option(test_case.arg_index)
-                                 }
+                test_outcomes = asyncio.run(run_checks(test, test_case))
 
                 # Parse results
                 result[display_name] = test_outcomes
 
                 # Write report
-                write_report(report_dir, display_name, ' '.join(test_case.command), test_case.char_offset, test_case.scan_range, test_outcomes)
+                write_report(report_dir, display_name, ' '.join(test_case.command), test_case.char_offset, test_case.scan_range, test_outcomes, encoding)
             except Exception:
                 log.error("Unexpected error when executing", exc_info=True)
 
@@ -49,7 +64,7 @@ def run_tests(test_cases: List[TestCase], threads: int, report_dir: str, log: lo
 
 def prepare_command(parser: argparse.ArgumentParser, command_flat: str, char_offset: int) -> Tuple[List[str], int, int]:
     """ Turns a flattened command string into a list, and generates a character offset in case none was provided """
-    log.info("Preparing parameters for {}".format(command_flat))
+    log.info("Preparing parameters for %s", command_flat)
     command_list = shlex.split(command_flat, posix=os.sep == '/')
     arg_index = -1
     if char_offset is not None:
@@ -59,7 +74,7 @@ def prepare_command(parser: argparse.ArgumentParser, command_flat: str, char_off
             selected_char = command_flat[char_offset]
             if (0 <= char_offset and char_offset < len(command_list[0])):
                 parser.error("cannot add characters to process name")
-            if not re.findall(r'[a-zA-Z0-9]', selected_char):
+            if not _ALNUM_RE.search(selected_char):
                 parser.error("selected char '{}' is not alphanumeric".format(selected_char))
 
             i = 0
@@ -75,7 +90,7 @@ def prepare_command(parser: argparse.ArgumentParser, command_flat: str, char_off
         char_offset = len(' '.join(command_list[0:arg_index])) + command_part_offset
 
         log.info("No char offset specified - using second char of first argument instead")
-    log.info("Char offset = {} (char '{}', argument index = {})".format(char_offset, command_flat[char_offset], arg_index))
+    log.info("Char offset = %s (char '%s', argument index = %s)", char_offset, command_flat[char_offset], arg_index)
     return (command_list, char_offset, arg_index)
 
 
@@ -107,10 +122,13 @@ def create_test_case(args: Namespace, parser: argparse.ArgumentParser, json_file
     else:
         raise ValueError("Unexpected range '{}'".format(args.range))
 
-    log.info('{} range selected ({} values)'.format(args.range, len(scan_range)))
+    # Leave out chars that can't be scanned, as well as duplicates from overlapping custom ranges
+    scan_range = [ordinal for ordinal in dict.fromkeys(scan_range) if ordinal not in _UNSCANNABLE]
+
+    log.info('%s range selected (%s values)', args.range, len(scan_range))
 
     # Parse report output dir
-    log.info('Report files will be stored in {}'.format(os.path.abspath(args.report_dir)))
+    log.info('Report files will be stored in %s', os.path.abspath(args.report_dir))
     if not os.path.isdir(args.report_dir):
         parser.error("path specified in --report_dir does not exist.")
 
@@ -124,7 +142,7 @@ log.setLevel(logging.DEBUG)
 
 def parse_arguments() -> None:
     # Prepare arguments
-    parser = argparse.ArgumentParser(add_help=False, description='Tool for identifying executables that have command-line options that can be obfuscated.')
+    parser = argparse.ArgumentParser(prog='analyse_obfuscation', add_help=False, description='Tool for identifying executables that have command-line options that can be obfuscated.')
 
     parser._action_groups.pop()
     required = parser.add_argument_group('required arguments (either is required)')
@@ -132,11 +150,12 @@ def parse_arguments() -> None:
     optional = parser.add_argument_group('optional arguments')
 
     # Global settings
-    optional.add_argument('--threads', metavar='n', type=int, help='Number of threads to use', default=None)
+    optional.add_argument('--threads', metavar='n', type=int, help='Number of commands to run concurrently', default=None)
     optional.add_argument('--verbose', action='store_true', help='Increase output verbosity')
     optional.add_argument('--quiet', action='store_true', help='Decrease output verbosity')
     optional.add_argument('--report_dir', metavar='c:\\path\\to\\dir', type=str, help='Path to save report files to', default="."+os.sep)
     optional.add_argument('--log_file', metavar='c:\\path\\to\\file.log', type=str, help='Path to save log to')
+    optional.add_argument('--utf16', action='store_true', help='Write report and log files as UTF-16LE instead of UTF-8')
     optional.add_argument('--help', action='help', default=argparse.SUPPRESS, help='Show this help message and exit')
 
     # Single command options
@@ -167,22 +186,28 @@ def parse_arguments() -> None:
         stream_handler.setLevel(logging.WARNING)
     log.addHandler(stream_handler)
 
+    # Parse output encoding options
+    encoding = 'utf-16le' if args.utf16 else 'utf-8-sig'
+
     # Parse log file options
     if args.log_file:
         file_path = os.path.abspath(args.log_file)
-        file_handler = logging.FileHandler(file_path, 'w', encoding='utf-16le')
+        file_handler = logging.FileHandler(file_path, 'w', encoding=encoding)
         file_handler.setLevel(logging.DEBUG)
         file_handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)-.4s] (%(threadName)-10s) %(message)s'))
         log.addHandler(file_handler)
 
+    # Don't create log records that none of the handlers would emit
+    log.setLevel(min(handler.level for handler in log.handlers))
+
     if args.json_file:
         single_command_args = ['command', 'range', 'custom_range', 'char_offset', 'pre_command', 'post_command', 'exit_code_only']
         given_args = {key: value for (key, value) in args._get_kwargs()}
         if any([given_args[x] for x in single_command_args]):
             raise ValueError("When --json_file is specified, the following arguments should not be specified on the command line but in the JSON file: {}".format(', '.join(single_command_args)))
 
-        with open(args.json_file, 'rt') as f:
-            for line in f.readlines():
+        with open(args.json_file, 'rt', encoding='utf-8') as f:
+            for line in f:
                 if not line.strip():
                     continue
                 t_args = argparse.Namespace()
@@ -192,7 +217,7 @@ def parse_arguments() -> None:
     else:
         tests = [create_test_case(args, parser, False)]
 
-    run_tests(tests, threads=args.threads, report_dir=args.report_dir, log=log)
+    run_tests(tests, threads=args.threads, report_dir=args.report_dir, encoding=encoding, log=log)
 
 
 if __name__ == "__main__":
@@ -1,15 +1,22 @@
+import asyncio
 import logging
 import os
 import random
 import re
 import shlex
 import subprocess
-from multiprocessing.pool import ThreadPool
-from typing import List, Set, Tuple, Union
+from typing import Callable, List, Set, Tuple, Union
 
-import tqdm
+from .helpers import SpecialCharOperation, get_progress_bar
 
-from .helpers import SpecialCharOperation
+_DELIMITERS_STANDARD = ('/', '-')
+_SHORT_SPLIT_RE = re.compile(r'[:=]')
+_OPTION_CHAR_ALTS = ('/', '\\', '\u2215', '\u244a', '\u2044', '\u29F8', '\u002D', '\u007E', '\u00AD', '\u058A', '\u05BE', '\u1400', '\u1806', '\u2010', '\u2012', '\u2013', '\u2014', '\u2015', '\u2053', '\u2212', '\u2E17', '\u2E3A', '\u2E3B', '\u301C', '\u3030', '\u30A0', '\uFE31', '\uFE32', '\uFE58', '\uFE63', '\uFF0D')
+# On Windows, don't allocate (or show) a console window for each child process
+_SPAWN_OPTIONS = {}
+if os.name == 'nt':
+    _SPAWN_OPTIONS['creationflags'] = subprocess.CREATE_NO_WINDOW
+    _SPAWN_OPTIONS['startupinfo'] = subprocess.STARTUPINFO(dwFlags=subprocess.STARTF_USESHOWWINDOW, wShowWindow=subprocess.SW_HIDE)
 
 
 class TestCase():
@@ -29,19 +36,22 @@ class TestProcessObfuscation():
         self.log = log
         self.command = test_case.command
         self.command_flat = ' '.join(test_case.command)
-        self.pre_command = test_case.pre_command
-        self.post_command = test_case.post_command
-        self.expected_code, self.expected_output = self.__get_expected_result__()
+        self.needs_random = '{random}' in self.command_flat
+        # Parse the pre/post commands once; on Windows they are passed on as raw command lines instead
+        self.pre_command = (shlex.split(test_case.pre_command, posix=True) if os.sep == '/' else test_case.pre_command) if test_case.pre_command else None
+        self.post_command = (test_case.post_command.split(' ') if os.sep == '/' else test_case.post_command) if test_case.post_command else None
         self.exit_code_only = test_case.exit_code_only
+        self.expected_code, self.expected_output = self.__get_expected_result__()
         self.scan_range = test_case.scan_range
+        self.scan_chars = [(ordinal, chr(ordinal)) for ordinal in self.scan_range]
         self.timeout = test_case.timeout
-        self.threads = threads
-        self.tqdm = None
+        self.threads = threads or os.cpu_count() or 1
+        self.slots = None
 
     # Class Methods
     @classmethod
-    def __randomise__(cls, command_parts: str) -> str:
-        randomised = ''.join(random.choices('0123456789ABCDEF', k=10))
+    def __randomise__(cls, command_parts: str, randomised: str = None) -> str:
+        randomised = randomised or ''.join(random.choices('0123456789ABCDEF', k=10))
         return command_parts.replace('{random}', randomised)
 
     @classmethod
@@ -52,7 +62,7 @@ class TestProcessObfuscation():
             if i == 0 or (arg_index is not None and i != arg_index):
                 continue
             # Check if the first character is a slash or hyphen - if so, select it
-            if command_part[0] in ['/', '-']:
+            if command_part.startswith(_DELIMITERS_STANDARD):
                 return i
         # If no option char was found, fall back to the first argument
         #  (least likely to be something like a filename)
@@ -68,81 +78,152 @@ class TestProcessObfuscation():
             #  the first char of a keyword which is usually not the best candidate
             if i == 0:
                 continue
-            if any([char == preferred_char for preferred_char in preferred_chars]):
+            if char in preferred_chars:
                 return i+1
 
         return (2 if command_part[1] != '-' else 3) if len(command_part) > 1 else 1
 
-    def __get_expected_result__(self) -> Tuple[int, str]:
+    def __get_expected_result__(self) -> Tuple[int, Tuple[bytes, bytes]]:
         # Prepare command to run
         command = self.__randomise__(self.command_flat)
         # Run 'normal' command to get expected exit code
         try:
-            result = self.__execute_command__(command, pre_command=self.pre_command)
-            exit_code, stdout = result.returncode, "{} / {}".format(result.stdout, result.stderr)
+            # The output is only needed if it is going to be compared
+            result = self.__execute_command__(command, command.split(' '), capture_output=not self.exit_code_only)
+            exit_code, stdout = result.returncode, (result.stdout, result.stderr)
             # Check if observed exit code is 0
             if exit_code != 0:
-                self.log.warning("Observed exit code is {}, which is not 0 as usual".format(exit_code))
+                self.log.warning("Observed exit code is %s, which is not 0 as usual", exit_code)
                 self.log.warning("Test outcome may contain unexpected results")
-                self.log.warning(stdout)
+                if not self.exit_code_only:
+                    self.log.warning("%s / %s", *stdout)
                 # sys.exit(-1)
         except FileNotFoundError:
-            self.log.error("Command \"{}\" could not be executed: file not found".format(command))
+            self.log.error("Command \"%s\" could not be executed: file not found", command)
             raise
         return exit_code, stdout
 
     # Private Methods
-    def __test_commands__(self, test: str, commands: List[Tuple[int, str]]) -> Set[Tuple[int, str]]:
-        self.log.info('Preparing {} commands to run'.format(len(commands)))
-        # Prepare ThreadPool
-        with ThreadPool(self.threads) as thread_pool:
-            # Prepare progress bar
-            with tqdm.tqdm(total=len(commands), desc=test, position=1, leave=False) as self.tqdm:
-                # Submit all commands to ThreadPool, collect results
-                outcomes = list(thread_pool.map(self.__run_command__, [command for _, command in commands]))
+    def __get_slots__(self) -> asyncio.Queue:
+        # Each slot allows one child process to be alive at any time, across all tests, and holds the post
+        #  command last started from it (if any); the queue is created lazily so that it belongs to the
+        #  event loop the tests are running on
+        if self.slots is None:
+            self.slots = asyncio.Queue()
+            for _ in range(self.threads):
+                self.slots.put_nowait(None)
+        return self.slots
+
+    async def __test_commands__(self, test: str, commands: List[Tuple[int, str]], argvs: List[List[str]] = None) -> Set[Tuple[int, str]]:
+        self.log.info('Preparing %s commands to run', len(commands))
+        # Tokenise commands, unless the caller already did so
+        if argvs is None:
+            argvs = [command.split(' ') for _, command in commands]
+        # Prepare progress bar, redrawing it only every so often (and not at all for short tests)
+        with get_progress_bar(total=len(commands), desc=test, leave=False, mininterval=0.5, miniters=50, smoothing=0, disable=len(commands) < 100) as progress_bar:
+            # Run all commands concurrently, collect results
+            tasks = [asyncio.ensure_future(self.__run_one__(command, argv)) for (_, command), argv in zip(commands, argvs)]
+            for task in tasks:
+                task.add_done_callback(lambda _: progress_bar.update())
+            outcomes = await asyncio.gather(*tasks)
         # Return all results when output was True
         return set([(identifier, command) for outcome, (identifier, command) in zip(outcomes, commands) if outcome])
 
-    def __run_command__(self, command: str):
-        # Prepare command
-        command = self.__randomise__(command)
-        # self.log.info('About to run command "{}"'.format(shlex.split(command, posix=False)))
+    async def __run_one__(self, command: str, argv: List[str]) -> bool:
+        # Wait for a free slot, and for the post command previously started from it to finish, as it may clean up
+        #  state that this command depends on
+        slots = self.__get_slots__()
+        await self.__wait_post_command__(await slots.get())
+        post_command = None
         try:
-            # Run command
-            result = self.__execute_command__(command, timeout=self.timeout, pre_command=self.pre_command)
-            exit_code, stdout = result.returncode, "{} / {}".format(result.stdout, result.stderr)
-            self.log.info('Exit code {} observed ({} desired) for {}'.format(exit_code, self.expected_code, command))
-            # Return result
-            return exit_code == self.expected_code and (self.exit_code_only or stdout == self.expected_output)
-        except subprocess.TimeoutExpired:
-            self.log.warning('Timeout ({}s) elapsed for command "{}"'.format(self.timeout, command))
-            return False
-        except Exception as e:
-            self.log.info("Exception when executing \"{}\": {}".format(command, e))
-            return False
+            # Prepare command, only touching the tokens that contain the placeholder
+            if self.needs_random:
+                randomised = ''.join(random.choices('0123456789ABCDEF', k=10))
+                command = self.__randomise__(command, randomised)
+                argv = [self.__randomise__(arg, randomised) if '{random}' in arg else arg for arg in argv]
+            try:
+                # Run command
+                result = await self.__execute_command_async__(command, argv, timeout=self.timeout, capture_output=not self.exit_code_only)
+                exit_code = result.returncode
+                self.log.info('Exit code %s observed (%s desired) for %s', exit_code, self.expected_code, command)
+                # Return result
+                return exit_code == self.expected_code and (self.exit_code_only or (result.stdout, result.stderr) == self.expected_output)
+            except subprocess.TimeoutExpired:
+                self.log.warning('Timeout (%ss) elapsed for command "%s"', self.timeout, command)
+                return False
+            except Exception as e:
+                self.log.info("Exception when executing \"%s\": %s", command, e)
+                return False
+            finally:
+                # Start the post command without waiting for it; the next command to use this slot will wait for it
+                #  before it starts, while this slot's result is already being processed
+                if self.post_command:
+                    post_command = await self.__start_post_command__()
         finally:
-            if self.post_command:
-                result = None
-                try:
-                    result = self.__execute_command__(self.post_command)
-                except Exception as e:
-                    self.log.warning("Post command caused exception ({})".format(e))
-                finally:
-                    self.log.info("Post command exited with exit code {}".format(result.returncode if result else "?"))
-            if self.tqdm:
-                self.tqdm.update()
+            slots.put_nowait(post_command)
+
+    async def __start_post_command__(self) -> Union[asyncio.subprocess.Process, subprocess.Popen, None]:
+        try:
+            if os.sep != '/':
+                return subprocess.Popen(self.post_command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **_SPAWN_OPTIONS)
+            return await asyncio.create_subprocess_exec(*self.post_command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except Exception as e:
+            self.log.warning("Post command caused exception (%s)", e)
+            return None
+
+    async def __wait_post_command__(self, post_command: Union[asyncio.subprocess.Process, subprocess.Popen, None]) -> None:
+        if post_command is None:
+            return
+        if isinstance(post_command, subprocess.Popen):
+            exit_code = await asyncio.get_running_loop().run_in_executor(None, post_command.wait)
+        else:
+            exit_code = await post_command.wait()
+        self.log.info("Post command exited with exit code %s", exit_code)
 
     def __get_option_argument__(self, arg_index: int) -> int:
         return self.select_arg_index(self.command, arg_index)
 
-    def __execute_command__(self, command: str, timeout: int = None, pre_command: list[str] = []) -> subprocess.CompletedProcess:
-        cmd = command.split(' ')  # list(shlex.shlex(command, punctuation_chars=True, posix=True)) #[shlex.quote(c) for c in shlex.split(command, posix=True)]
-        # self.log.debug('About to run command "{}"'.format(' '.join(cmd)))
-        p1 = subprocess.Popen(shlex.split(pre_command, posix=True) if os.sep == '/' else pre_command, stdin=subprocess.PIPE, stdout=subprocess.PIPE) if pre_command else None
-        return subprocess.run(cmd if os.sep == '/' else command, stdin=p1.stdout if p1 else None, capture_output=True, timeout=timeout)
+    def __splice_command__(self, arg_index: int) -> Callable[[str], str]:
+        # Join the arguments around the given one only once; each candidate just fills in the gap
+        prefix, suffix = ' '.join(self.command[:arg_index]), ' '.join(self.command[arg_index+1:])
+        prefix, suffix = prefix and f'{prefix} ', suffix and f' {suffix}'
+        return lambda arg: f'{prefix}{arg}{suffix}'
+
+    def __execute_command__(self, command: str, cmd: List[str], timeout: int = None, capture_output: bool = True) -> subprocess.CompletedProcess:
+        # The argument list is used on POSIX, the raw command line on Windows (quotes don't survive list2cmdline)
+        p1 = subprocess.Popen(self.pre_command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, **_SPAWN_OPTIONS) if self.pre_command else None
+        output = subprocess.PIPE if capture_output else subprocess.DEVNULL
+        return subprocess.run(cmd if os.sep == '/' else command, stdin=p1.stdout if p1 else None, stdout=output, stderr=output, timeout=timeout, **_SPAWN_OPTIONS)
+
+    async def __execute_command_async__(self, command: str, cmd: List[str], timeout: int = None, capture_output: bool = True) -> subprocess.CompletedProcess:
+        if os.sep != '/':
+            # asyncio can only spawn from an argument list, which gets re-quoted via list2cmdline on Windows;
+            #  hand the raw command line to a worker thread instead so it reaches the process unaltered
+            return await asyncio.get_running_loop().run_in_executor(None, self.__execute_command__, command, cmd, timeout, capture_output)
+        p1 = subprocess.Popen(self.pre_command, stdin=subprocess.PIPE, stdout=subprocess.PIPE) if self.pre_command else None
+        output = subprocess.PIPE if capture_output else subprocess.DEVNULL
+        try:
+            proc = await asyncio.create_subprocess_exec(*cmd, stdin=p1.stdout if p1 else None, stdout=output, stderr=output)
+        finally:
+            if p1:
+                p1.stdout.close()
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise subprocess.TimeoutExpired(cmd, timeout)
+        return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr)
 
     # Public Methods
-    def check_special_chars(self, char_at_position: int, operation: SpecialCharOperation) -> Set[Tuple[int, str]]:
+    async def wait_post_commands(self) -> None:
+        # Wait for the post commands still running after the last commands of each slot
+        slots = self.__get_slots__()
+        for _ in range(slots.qsize()):
+            await self.__wait_post_command__(slots.get_nowait())
+            slots.put_nowait(None)
+
+    async def check_special_chars(self, char_at_position: int, operation: SpecialCharOperation) -> Set[Tuple[int, str]]:
         # Prepare operation
         op = None
         if operation == SpecialCharOperation.INSERT:
@@ -153,13 +234,22 @@ class TestProcessObfuscation():
             command_parts = self.command_flat[:char_at_position], self.command_flat[char_at_position+1:]
         else:
             raise ValueError('Unexpected operation {}'.format(operation))
-        self.log.info("Starting 'special chars ({})' test".format(op))
+        self.log.info("Starting 'special chars (%s)' test", op)
+        # Tokenise both halves once; each candidate only differs in the token the char is spliced into
+        head, tail = command_parts[0].split(' '), command_parts[1].split(' ')
+        head, token_start, token_end, tail = head[:-1], head[-1], tail[0], tail[1:]
         # Prepare commands to run (excluding 'original' command)
-        new_commands = [(ordinal, chr(ordinal).join(command_parts)) for ordinal in self.scan_range if operation != SpecialCharOperation.REPLACE or chr(ordinal).lower() != self.command_flat[char_at_position].lower()]
+        if operation == SpecialCharOperation.REPLACE:
+            target = self.command_flat[char_at_position].lower()
+            chars = [(ordinal, char) for ordinal, char in self.scan_chars if char.lower() != target]
+        else:
+            chars = self.scan_chars
+        new_commands = [(ordinal, char.join(command_parts)) for ordinal, char in chars]
+        new_argvs = [head + (token_start + char + token_end).split(' ') + tail for _, char in chars]
         # Run commands, return results
-        return self.__test_commands__("Special chars ({})".format(op), new_commands)
+        return await self.__test_commands__("Special chars ({})".format(op), new_commands, new_argvs)
 
-    def check_quote_injection(self, arg_index: int) -> Union[str, None]:
+    async def check_quote_injection(self, arg_index: int) -> Union[str, None]:
         self.log.info("Starting 'quote insertion' test")
         # Check if valid command was given
         if not self.command or len(self.command) < 2:
@@ -168,13 +258,13 @@ class TestProcessObfuscation():
         command_part = self.__get_option_argument__(arg_index)
         quote = '"'  # if os.sep != '/' else '\\"'
         test_arg = self.command[command_part][:1] + quote + self.command[command_part][1] + quote + self.command[command_part][2:]
-        new_command = ' '.join(self.command[:command_part] + [test_arg] + self.command[command_part+1:])
+        new_command = self.__splice_command__(command_part)(test_arg)
         # Quotes don't work in subprocess when using lists
-        result = self.__run_command__(new_command)
+        result = await self.__run_one__(new_command, new_command.split(' '))
         # Return command if working, blank string if not
         return new_command if result else ''
 
-    def check_shortened_option(self, arg_index: int) -> Union[None, Set[Tuple[int, str]]]:
+    async def check_shortened_option(self, arg_index: int) -> Union[None, Set[Tuple[int, str]]]:
         self.log.info("Starting 'shortened option' test")
         # Check if valid command was given
         if not self.command or len(self.command) < 2:
@@ -182,54 +272,53 @@ class TestProcessObfuscation():
         # Shorten the second argument by [1..len(command)-1] chars
         selected_command_part_index = self.__get_option_argument__(arg_index)
         selected_command_part = self.command[selected_command_part_index]
+        splice = self.__splice_command__(selected_command_part_index)
         new_commands = []
         # check if there are any colons or equal signs in there (e.g. /active:true)
-        selected_command_part_split = list(filter(None, re.split("[:=]", selected_command_part)))
+        selected_command_part_split = list(filter(None, _SHORT_SPLIT_RE.split(selected_command_part)))
         if len(selected_command_part_split) > 1:
             # If so, only try to shorten the first bit - leave the argument intact (e.g. /activ:true.../a:true)
             size = len(selected_command_part_split[0])
             # Check if argument is long enough
             if size <= 2:
-                self.log.info("Length of selected command-line option is {}, cannot be further shortened".format(size))
+                self.log.info("Length of selected command-line option is %s, cannot be further shortened", size)
                 return None
             for i in range(size-1):
                 test_arg = selected_command_part[0:(i+1)] + selected_command_part[size:]
-                new_commands.append((i, ' '.join(self.command[:selected_command_part_index] + [test_arg] + self.command[(selected_command_part_index+1):])))
+                new_commands.append((i, splice(test_arg)))
         else:
             # If not, just shorten the full argument
             size = len(selected_command_part)
             # Check if argument is long enough
             if size <= 2:
-                self.log.info("Length of selected command-line option is {}, cannot be further shortened".format(size))
+                self.log.info("Length of selected command-line option is %s, cannot be further shortened", size)
                 return None
             for i in range(size-1):
                 test_arg = selected_command_part[0:(i+1)]
-                new_commands.append((i, ' '.join(self.command[:selected_command_part_index] + [test_arg] + self.command[(selected_command_part_index+1):])))
+                new_commands.append((i, splice(test_arg)))
         # Return results of commands if any were generated, None if not
-        return self.__test_commands__("Shorthand command", new_commands) if new_commands else None
+        return await self.__test_commands__("Shorthand command", new_commands) if new_commands else None
 
-    def check_option_char(self, arg_index_start: int = 1) -> Union[None, Set[Tuple[int, str]]]:
+    async def check_option_char(self, arg_index_start: int = 1) -> Union[None, Set[Tuple[int, str]]]:
         self.log.info("Starting 'option char subtitution' test")
 
-        delimiters_alternative = ['/', '\\', '\u2215', '\u244a', '\u2044', '\u29F8', '\u002D', '\u007E', '\u00AD', '\u058A', '\u05BE', '\u1400', '\u1806', '\u2010', '\u2010', '\u2012', '\u2013', '\u2014', '\u2015', '\u2053', '\u2212', '\u2212', '\u2212', '\u2E17', '\u2E3A', '\u2E3B', '\u301C', '\u3030', '\u30A0', '\uFE31', '\uFE32', '\uFE58', '\uFE63', '\uFF0D']
-        delimiters_standard = ['/', '-']
-        self.log.info("Looking for arguments starting with one of: {}".format(' '.join(delimiters_standard)))
+        self.log.info("Looking for arguments starting with one of: %s", ' '.join(_DELIMITERS_STANDARD))
 
         # Iterate over command-line arguments
         for i, command in enumerate(self.command[arg_index_start:], start=arg_index_start):
             # Check if delimiter is present
-            if any([command.startswith(delimiter) for delimiter in delimiters_standard]):
+            if command.startswith(_DELIMITERS_STANDARD):
                 # If so, find its position
                 pos = sum([len(c)+1 for c in self.command[:i]])
                 # Break command in two parts
                 command_parts = self.command_flat[:pos], self.command_flat[pos+1:]
-                self.log.info("Argument found ({})".format(command))
-                self.log.info("Preparing {} alternative signs to test".format(len(delimiters_alternative)))
+                self.log.info("Argument found (%s)", command)
+                self.log.info("Preparing %s alternative signs to test", len(_OPTION_CHAR_ALTS))
                 break
         else:
             self.log.info("No arguments found")
             return None  # No option char found
 
-        # Prepare commands to test
-        new_commands = [(ord(char), char.join(command_parts)) for char in delimiters_alternative]
-        return self.__test_commands__("Dash/hyphen", [command for command in new_commands if command[1] != self.command_flat])
+        # Prepare commands to test (excluding 'original' command); the alternatives are unique, and so are the commands
+        new_commands = [(ord(char), char.join(command_parts)) for char in _OPTION_CHAR_ALTS]
+        return await self.__test_commands__("Dash/hyphen", [(ordinal, command) for ordinal, command in new_commands if command != self.command_flat])